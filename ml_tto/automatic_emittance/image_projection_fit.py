@@ -1,11 +1,13 @@
 from copy import copy, deepcopy
+from functools import lru_cache
 from typing import List, Optional
+import logging
 import warnings
 
 import numpy as np
 from numpy import ndarray
 from pydantic import ConfigDict, PositiveFloat, Field, confloat
-import scipy
+import scipy.signal
 from scipy.stats import norm, gamma, uniform
 
 from lcls_tools.common.data.fit.methods import GaussianModel
@@ -22,6 +24,8 @@ from lcls_tools.common.data.fit.method_base import (
 
 from ml_tto.automatic_emittance.plotting import plot_image_projection_fit
 
+logger = logging.getLogger(__name__)
+
 
 class ImageProjectionFitResult(ImageFitResult):
     projection_fit_method: MethodBase
@@ -37,6 +41,76 @@ class ImageProjectionFitResult(ImageFitResult):
     )
 
 
+@lru_cache(maxsize=32)
+def _gaussian_kernel(filter_size: int, truncate: float = 4.0) -> ndarray:
+    """
+    Normalized Gaussian kernel with sigma=filter_size truncated at `truncate`
+    standard deviations, matching the kernel used by
+    `scipy.ndimage.gaussian_filter1d`. Cached on the filter size.
+    """
+    radius = int(truncate * filter_size + 0.5)
+    x = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 * (x / filter_size) ** 2)
+    kernel /= kernel.sum()
+    kernel.setflags(write=False)
+    return kernel
+
+
+def _gaussian_filter(data: ndarray, filter_size: int) -> ndarray:
+    """
+    Smooth a 1d projection with a Gaussian filter, equivalent to
+    `scipy.ndimage.gaussian_filter1d(data, filter_size)` (reflect boundary mode)
+    but without the n-dimensional ndimage dispatch overhead. Very long projections
+    are convolved via FFT.
+    """
+    kernel = _gaussian_kernel(filter_size)
+    radius = len(kernel) // 2
+    if radius > len(data):
+        # the padding reflects more than once, let numpy handle it
+        padded = np.pad(data, radius, mode="symmetric")
+    else:
+        padded = np.concatenate(
+            (data[radius - 1 :: -1], data, data[: -radius - 1 : -1])
+        )
+
+    # direct convolution is faster up to ~4096 pixels with kernels scaled to the
+    # projection length
+    if len(data) > 4096:
+        return scipy.signal.fftconvolve(padded, kernel, mode="valid")
+    return np.convolve(padded, kernel, mode="valid")
+
+
+def _residual_std(
+    model: MethodBase, x: ndarray, parameters: dict, projection: ndarray
+) -> float:
+    """
+    Standard deviation of the residual between the model evaluated with the fit
+    parameters and the projection data. Models using the stock Gaussian forward
+    function are evaluated in a single buffer without intermediate temporaries,
+    other models go through their own forward().
+    """
+    if not (
+        isinstance(model, GaussianModel)
+        and type(model)._forward is GaussianModel._forward
+    ):
+        return np.std(model.forward(x, parameters) - projection)
+
+    residual = np.subtract(x, parameters["mean"], dtype=np.float64)
+    residual /= parameters["sigma"]
+    residual *= residual
+    residual *= -0.5
+    np.exp(residual, out=residual)
+    residual *= parameters["amplitude"]
+    residual += parameters["offset"]
+    residual -= projection
+    return residual.std()
+
+
+def _nan_params(params: dict) -> dict:
+    """Return a copy of the fit parameter dict with every value set to NaN."""
+    return dict.fromkeys(params, np.nan)
+
+
 class MLProjectionFit(ProjectionFit):
     """
     1d fitting class that allows users to choose the model with which the fit
@@ -64,9 +138,7 @@ class MLProjectionFit(ProjectionFit):
         filter_size = int(len(projection_data) * self.relative_filter_size)
 
         if filter_size > 0:
-            projection_data = scipy.ndimage.gaussian_filter1d(
-                projection_data, filter_size
-            )
+            projection_data = _gaussian_filter(projection_data, filter_size)
 
         self.model.profile_data = projection_data
 
@@ -161,58 +233,83 @@ class ImageProjectionFit(ImageProjectionFit):
     # )
 
     def _fit_image(self, image: ndarray) -> ImageProjectionFitResult:
-        fit_parameters = []
-        noise_stds = []
-        signal_to_noise_ratios = []
-        beam_extent = []
+        """
+        Fit the x/y projections of the image. Projections are computed from a
+        C-contiguous float32 copy of the image and accumulated in float64 so that
+        the total intensity of integer images is exact. The original image is
+        stored in the result unchanged.
+        """
+        # compute both projections up front and reuse the x projection for the
+        # total intensity rather than doing a third pass over the full image
+        projection_image = np.ascontiguousarray(image, dtype=np.float32)
+        projections = [
+            projection_image.sum(axis=0, dtype=np.float64),
+            projection_image.sum(axis=1, dtype=np.float64),
+        ]
+        total_intensity = float(projections[0].sum())
 
-        direction = ["x", "y"]
-        for i in range(2):
-            projection = np.array(np.sum(image, axis=i))
-            parameters = self.projection_fit.fit_projection(projection)
-
-            # determine the noise around the projection fit
-            x = np.arange(len(projection))
-            noise_std = np.std(
-                self.projection_fit.model.forward(x, parameters) - projection
-            )
-            noise_stds.append(noise_std)
-            signal_to_noise_ratios.append(parameters["amplitude"] / noise_std)
-
-            # if the amplitude of the the fit is smaller than noise then reject
-            if signal_to_noise_ratios[-1] < self.signal_to_noise_threshold:
-                for name in parameters.keys():
-                    parameters[name] = np.nan
+        # pixel coordinates for evaluating the fits, shared by both axes if square
+        nx, ny = len(projections[0]), len(projections[1])
+        x_coordinates = np.arange(nx)
+        y_coordinates = x_coordinates if ny == nx else np.arange(ny)
+        coordinates = [x_coordinates, y_coordinates]
 
-                warnings.warn(
-                    f"Projection in {direction[i]} had a low amplitude relative to noise"
-                )
+        fit_parameters = [
+            self.projection_fit.fit_projection(projection)
+            for projection in projections
+        ]
 
-            fit_parameters.append(parameters)
+        # determine the noise around the projection fits
+        noise_stds = np.array(
+            [
+                _residual_std(
+                    self.projection_fit.model,
+                    coordinates[i],
+                    fit_parameters[i],
+                    projections[i],
+                )
+                for i in range(2)
+            ]
+        )
+        amplitudes, means, sigmas = (
+            np.array([parameters[name] for parameters in fit_parameters])
+            for name in ("amplitude", "mean", "sigma")
+        )
+        signal_to_noise_ratios = amplitudes / noise_stds
+
+        # if the amplitude of the the fit is smaller than noise then reject
+        low_signal = signal_to_noise_ratios < self.signal_to_noise_threshold
+
+        # calculate the extent of the beam in the projection - scaled to the image size
+        beam_extent = np.stack(
+            [
+                means - self.beam_extent_n_stds * sigmas,
+                means + self.beam_extent_n_stds * sigmas,
+            ],
+            axis=1,
+        )
+        beam_extent[low_signal] = np.nan
 
-            # calculate the extent of the beam in the projection - scaled to the image size
-            beam_extent.append(
-                [
-                    parameters["mean"] - self.beam_extent_n_stds * parameters["sigma"],
-                    parameters["mean"] + self.beam_extent_n_stds * parameters["sigma"],
-                ]
-            )
+        # if the beam extent is outside the image then its off the screen etc. and fits cannot be trusted
+        off_screen = (beam_extent[:, 0] < 0) | (beam_extent[:, 1] > [nx, ny])
 
-            # if the beam extent is outside the image then its off the screen etc. and fits cannot be trusted
-            if beam_extent[-1][0] < 0 or beam_extent[-1][1] > len(projection):
-                for name in parameters.keys():
-                    parameters[name] = np.nan
+        direction = ["x", "y"]
+        for i in np.flatnonzero(low_signal | off_screen):
+            fit_parameters[i] = _nan_params(fit_parameters[i])
 
+            if low_signal[i]:
+                warnings.warn(
+                    f"Projection in {direction[i]} had a low amplitude relative to noise"
+                )
+            else:
                 warnings.warn(
                     f"Projection in {direction[i]} was off the screen, fit cannot be trusted"
                 )
 
-                continue
-
         result = ImageProjectionFitResult(
             centroid=[ele["mean"] for ele in fit_parameters],
             rms_size=[ele["sigma"] for ele in fit_parameters],
-            total_intensity=image.sum(),
+            total_intensity=total_intensity,
             projection_fit_parameters=fit_parameters,
             image=image,
             projection_fit_method=self.projection_fit.model,
@@ -228,6 +325,10 @@ class RecursiveImageProjectionFit(ImageProjectionFit):
     n_stds: PositiveFloat = Field(
         4.0, description="Number of standard deviations to use for the bounding box"
     )
+    min_crop_fraction: confloat(gt=0, le=1) = Field(
+        0.95,
+        description="Skip the refit if the cropped image keeps at least this fraction of the image area",
+    )
     projection_fit: Optional[ProjectionFit] = MLProjectionFit(
         model=MLGaussianModel(use_priors=True), relative_filter_size=0.01
     )
@@ -245,47 +346,48 @@ class RecursiveImageProjectionFit(ImageProjectionFit):
             b. refit the image to get a more accurate beam size and location
             c. update the fit parameters to reflect the new image size
             d. recalculate the noise std and signal to noise ratio
-        3. If the fit is not successful in either direction then return the original image and fit parameters
+        3. If the fit is not successful in either direction, or the bounding box covers
+           (nearly) the whole image, then return the original image and fit parameters
 
         """
         fresult = super()._fit_image(image)
 
-        rms_size = np.array(fresult.rms_size)
-        centroid = np.array(fresult.centroid)
-        print(rms_size, centroid)
+        rms_size = np.asarray(fresult.rms_size)
+        centroid = np.asarray(fresult.centroid)
+        logger.debug("initial fit rms_size=%s centroid=%s", rms_size, centroid)
 
         # if all rms sizes are nan then we can't crop the image
         if np.all(np.isnan(rms_size)):
             return fresult
 
-        # get ranges for clipping
-        crop_ranges = []
-        for i in range(2):
-            # if the rms size is nan then we can't crop this direction
-            if np.isnan(rms_size[i]):
-                r = np.array([0, image.shape[i]]).astype(int)
-            else:
-                # set a minimum size for the crop to avoid cropping too small
-                half_width = np.max((10.0, rms_size[i] * self.n_stds))
-                r = np.array(
-                    [
-                        centroid[i] - half_width,
-                        centroid[i] + half_width,
-                    ]
-                ).astype(int)
-                r = np.clip(r, 0, image.shape[i])
+        # image extent along (x, y), i.e. the lengths of the x and y projections
+        image_extent = np.array(image.shape[::-1])
+
+        # get ranges for clipping, rows are (x, y) and columns are (lower, upper),
+        # set a minimum size for the crop to avoid cropping too small
+        half_width = np.maximum(10.0, rms_size * self.n_stds)
+        crop_ranges = np.stack([centroid - half_width, centroid + half_width], axis=1)
 
-            crop_ranges.append(r)
+        # if the rms size is nan then we can't crop this direction
+        full_ranges = np.stack([np.zeros(2), image_extent], axis=1)
+        crop_ranges = np.where(np.isnan(rms_size)[:, None], full_ranges, crop_ranges)
 
-        crop_ranges = np.array(crop_ranges)
-        crop_widths = crop_ranges[:, 1] - crop_ranges[:, 0] + 1
+        # clip each axis to its own image extent
+        crop_ranges[:, 0] = np.maximum(crop_ranges[:, 0], 0)
+        crop_ranges[:, 1] = np.minimum(crop_ranges[:, 1], image_extent)
+        crop_ranges = crop_ranges.astype(np.intp)
+
+        # if cropping barely reduces the image then refitting won't change the result
+        crop_area = np.prod(crop_ranges[:, 1] - crop_ranges[:, 0])
+        if crop_area >= self.min_crop_fraction * image.size:
+            return fresult
 
         # crop the image based on the bounding box
         cropped_image = image[
             crop_ranges[1][0] : crop_ranges[1][1], crop_ranges[0][0] : crop_ranges[0][1]
         ]
 
-        print(centroid, rms_size)
+        logger.debug("refitting image cropped to ranges %s", crop_ranges.tolist())
         # do final fit
         self.beam_extent_n_stds = 2.0
         result = super()._fit_image(cropped_image)
@@ -294,7 +396,7 @@ class RecursiveImageProjectionFit(ImageProjectionFit):
         for i in range(2):
             if np.isfinite(result.rms_size[i]) and np.isfinite(centroid[i]):
                 # we cropped in this direction so we need to update the fit parameters
-                result.centroid[i] += centroid[i] - crop_widths[i] / 2
-                result.beam_extent[i] += centroid[i] - crop_widths[i] / 2
+                result.centroid[i] += crop_ranges[i][0]
+                result.beam_extent[i] += crop_ranges[i][0]
 
         return result
@@ -1,7 +1,6 @@
 from typing import Dict, Any
 import h5py
 import numpy as np
-from pydantic import validate_call
 
 
 class H5Saver:
@@ -25,11 +24,16 @@ class H5Saver:
 
         self.string_dtype = "utf-8"
         self.supported_types = (bool, int, float, np.integer, np.floating)
+        # numeric arrays larger than this (in bytes) are saved chunked and compressed
+        self.compression_threshold = 64 * 1024
+        # raw data chunk cache size used when opening files
+        self.chunk_cache_nbytes = 64 * 1024 * 1024
+        self.chunk_cache_nslots = 100003
 
-    @validate_call
     def save_to_h5(self, data: Dict[str, Any], filepath: str):
         """
-        Save a dictionary to an HDF5 file.
+        Save a dictionary to an HDF5 file. Files are written with the latest
+        HDF5 file format and require HDF5 1.10+ to read.
         Arguments:
         ------------------------
         data: Dict[str, Any]
@@ -42,25 +46,71 @@ class H5Saver:
         None
         """
 
-        dt = h5py.string_dtype(encoding=self.string_dtype)
+        # only check the top level types, validating every entry is expensive
+        if not isinstance(data, dict):
+            raise TypeError(f"data must be a dict, got {type(data).__name__}")
+        if not isinstance(filepath, str):
+            raise TypeError(f"filepath must be a str, got {type(filepath).__name__}")
 
-        def recursive_save(d, f):
+        dt = h5py.string_dtype(encoding=self.string_dtype)
+        supported_types = self.supported_types
+
+        def create_numeric_dataset(f, key, val):
+            val = np.asarray(val)
+            kwargs = {}
+            if val.nbytes > self.compression_threshold:
+                # keep chunks of 2D images small so that partial reads are cheap
+                chunks = True
+                if val.ndim == 2:
+                    chunks = (min(val.shape[0], 256), min(val.shape[1], 256))
+                kwargs = {"chunks": chunks, "compression": "lzf", "shuffle": True}
+
+            f.create_dataset(key, data=val, track_order=True, **kwargs)
+
+        def save_dict(data, file):
+            # walk nested dicts with an explicit stack of (dict, group) pairs
+            # instead of recursing
+            stack = [(data, file)]
+            while stack:
+                d, f = stack.pop()
+                save_items(d, f, stack)
+
+        def save_items(d, f, stack):
             for key, val in d.items():
                 if key == "attrs":
-                    f.attrs.update(val or h5py.Empty("f4"))
+                    if val:
+                        f.attrs.update(val)
                 elif isinstance(val, dict):
                     group = f.create_group(key, track_order=True)
-                    recursive_save(val, group)
+                    stack.append((val, group))
                 elif isinstance(val, list):
-                    if all(isinstance(ele, self.supported_types) for ele in val):
-                        f.create_dataset(key, data=val, track_order=True)
-                    elif isinstance(val, np.ndarray):
-                        if val.dtype != np.dtype('O'):
-                            f.create_dataset(key, data=val, track_order=True)
+                    # all() stops at the first non-string, cheap for numeric lists
+                    is_string_list = bool(val) and all(
+                        isinstance(ele, str) for ele in val
+                    )
+
+                    # let numpy do the type check for numeric lists, ragged or
+                    # mixed lists fall through to the per-element handling below
+                    arr = None
+                    if not is_string_list:
+                        try:
+                            arr = np.asarray(val)
+                        except ValueError:
+                            pass
+
+                    if is_string_list:
+                        f.create_dataset(
+                            key,
+                            data=np.array(val, dtype=object),
+                            dtype=dt,
+                            track_order=True,
+                        )
+                    elif arr is not None and arr.dtype.kind in "biufc":
+                        create_numeric_dataset(f, key, arr)
                     elif all(isinstance(ele, dict) for ele in val):
                         for i, ele in enumerate(val):
                             group = f.create_group(f"{key}/{i}", track_order=True)
-                            recursive_save(ele, group)
+                            stack.append((ele, group))
                     else:
                         for i, ele in enumerate(val):
                             if isinstance(ele, str):
@@ -71,19 +121,25 @@ class H5Saver:
                                 f.create_dataset(
                                     f"{key}/{i}", data=str(ele), track_order=True
                                 )
-                elif isinstance(val, self.supported_types):
+                elif isinstance(val, supported_types):
                     f.create_dataset(key, data=val, track_order=True)
                 elif isinstance(val, np.ndarray):
                     if val.dtype != np.dtype('O'):
-                        f.create_dataset(key, data=val, track_order=True)
+                        create_numeric_dataset(f, key, val)
                 elif isinstance(val, str):
                     # specify string dtype to avoid issues with encodings
                     f.create_dataset(key, data=val, dtype=dt, track_order=True)
                 else:
                     f.create_dataset(key, data=str(val), track_order=True)
 
-        with h5py.File(filepath, "w") as file:
-            recursive_save(data, file)
+        with h5py.File(
+            filepath,
+            "w",
+            libver="latest",
+            rdcc_nbytes=self.chunk_cache_nbytes,
+            rdcc_nslots=self.chunk_cache_nslots,
+        ) as file:
+            save_dict(data, file)
 
     def load_from_h5(self, filepath):
         """Convenience method to load a dictionary from an HDF5 file.
@@ -99,17 +155,40 @@ class H5Saver:
             The dictionary loaded from the file.
         """
 
-        def recursive_load(f):
-            d = {"attrs": dict(f.attrs)} if f.attrs else {}
-            for key, val in f.items():
-                if isinstance(val, h5py.Group):
-                    d[key] = recursive_load(val)
-                elif isinstance(val, h5py.Dataset):
-                    if isinstance(val[()], bytes):
-                        d[key] = val[()].decode(self.string_dtype)
-                    else:
-                        d[key] = val[()]
-            return d
-
-        with h5py.File(filepath, "r") as file:
-            return recursive_load(file)
+        def new_dict(f):
+            return {"attrs": dict(f.attrs)} if f.attrs else {}
+
+        def load_dict(file):
+            # walk nested groups with an explicit stack of (group, dict) pairs
+            # instead of recursing
+            data = new_dict(file)
+            stack = [(file, data)]
+            while stack:
+                f, d = stack.pop()
+                for key, val in f.items():
+                    if isinstance(val, h5py.Group):
+                        d[key] = new_dict(val)
+                        stack.append((val, d[key]))
+                    elif isinstance(val, h5py.Dataset):
+                        # variable length string arrays are saved from lists of str
+                        string_info = h5py.check_string_dtype(val.dtype)
+                        if (
+                            val.ndim > 0
+                            and string_info is not None
+                            and string_info.length is None
+                        ):
+                            d[key] = val.asstr(self.string_dtype)[()].tolist()
+                        elif isinstance(val[()], bytes):
+                            d[key] = val[()].decode(self.string_dtype)
+                        else:
+                            d[key] = val[()]
+            return data
+
+        with h5py.File(
+            filepath,
+            "r",
+            libver="latest",
+            rdcc_nbytes=self.chunk_cache_nbytes,
+            rdcc_nslots=self.chunk_cache_nslots,
+        ) as file:
+            return load_dict(file)
@@ -1,14 +1,28 @@
 import numpy as np
 import pytest
+from scipy.ndimage import gaussian_filter1d
 
 from ml_tto.automatic_emittance.image_projection_fit import (
     ImageProjectionFit,
+    MLGaussianModel,
     RecursiveImageProjectionFit,
+    _gaussian_filter,
+    _residual_std,
 )
 from ml_tto.automatic_emittance.plotting import plot_image_projection_fit
 
 
 class TestImageProjectionFit:
+    @pytest.mark.parametrize(
+        "n, filter_size",
+        [(100, 1), (10, 5), (4, 1), (2000, 20), (4096, 40), (4097, 40)],
+    )
+    def test_gaussian_filter(self, n, filter_size):
+        data = np.random.default_rng(0).random(n)
+        filtered = _gaussian_filter(data, filter_size)
+        assert filtered.shape == (n,)
+        assert np.allclose(filtered, gaussian_filter1d(data, filter_size))
+
     @pytest.mark.parametrize("image_projection_fit", [ImageProjectionFit(), RecursiveImageProjectionFit()])
     def test_image_projection_fits(self, image_projection_fit):
         test_image = np.zeros((100, 100))
@@ -38,6 +52,70 @@ class TestImageProjectionFit:
 
         plot_image_projection_fit(result)
 
+    @pytest.mark.parametrize("image_projection_fit", [ImageProjectionFit(), RecursiveImageProjectionFit()])
+    def test_non_square_image_fits(self, image_projection_fit):
+        # beam is outside the y extent of the image along x
+        test_image = np.zeros((60, 120))
+        test_image[20:40, 80:100] = 1.0
+
+        result = image_projection_fit.fit_image(test_image)
+        assert np.allclose(result.centroid, [89.5, 29.5], rtol=1e-2)
+        assert np.allclose(result.rms_size, [7.7789, 7.7789], rtol=1e-1)
+
+    def test_gaussian_residual_std(self):
+        model = MLGaussianModel()
+        x = np.arange(100)
+        parameters = {"mean": 40.0, "sigma": 8.0, "amplitude": 20.0, "offset": 1.5}
+        projection = np.random.default_rng(0).random(100) * 20.0
+
+        assert np.isclose(
+            _residual_std(model, x, parameters, projection),
+            np.std(model.forward(x, parameters) - projection),
+        )
+
+    def test_integer_image_total_intensity(self):
+        # column sums exceed 2**24 so float32 accumulation would not be exact
+        x, y = np.meshgrid(np.arange(400), np.arange(400))
+        beam = np.exp(-((x - 200) ** 2 + (y - 200) ** 2) / (2 * 20.0**2))
+        test_image = (50001 + 15000 * beam).astype(np.uint16)
+
+        result = ImageProjectionFit().fit_image(test_image)
+        assert result.total_intensity == int(test_image.sum(dtype=np.int64))
+
+    def test_recursive_fit_skips_full_frame_crop(self, monkeypatch):
+        # beam fills the frame, the crop keeps ~96% of the image area
+        x, y = np.meshgrid(np.arange(100), np.arange(100))
+        test_image = np.exp(
+            -((x - 49.5) ** 2) / (2 * 15.0**2) - (y - 49.5) ** 2 / (2 * 12.1**2)
+        )
+
+        n_calls = []
+        fit_image = ImageProjectionFit._fit_image
+
+        def counted_fit_image(self, image):
+            n_calls.append(image.shape)
+            return fit_image(self, image)
+
+        monkeypatch.setattr(ImageProjectionFit, "_fit_image", counted_fit_image)
+
+        first_pass = ImageProjectionFit().fit_image(test_image)
+        n_calls.clear()
+
+        result = RecursiveImageProjectionFit().fit_image(test_image)
+        assert len(n_calls) == 1
+        assert np.allclose(result.centroid, first_pass.centroid)
+        assert np.allclose(result.rms_size, first_pass.rms_size)
+        assert np.allclose(result.beam_extent, first_pass.beam_extent)
+        n_calls.clear()
+
+        # requiring the crop to keep the full image forces the refit
+        result = RecursiveImageProjectionFit(min_crop_fraction=1.0).fit_image(
+            test_image
+        )
+        assert len(n_calls) == 2
+        assert n_calls[1][0] < test_image.shape[0]
+        assert np.allclose(result.centroid, [49.5, 49.5], rtol=1e-2)
+
     @pytest.mark.parametrize("image_projection_fit", [ImageProjectionFit(), RecursiveImageProjectionFit()])
     def test_single_pixel_image_fits(self, image_projection_fit):
     
@@ -1,5 +1,9 @@
+from pathlib import Path
+
 from ml_tto.saver import H5Saver
+import h5py
 import numpy as np
+import pytest
 
 class TestSaver:
     def test_nans(self):
@@ -15,4 +19,82 @@ class TestSaver:
             "h": "np.Nan",
             "i": np.array((1.0,2.0), dtype="O"),
         }
-        saver.save_to_h5(data, "test.h5")
\ No newline at end of file
+        saver.save_to_h5(data, "test.h5")
+
+    def test_numeric_lists(self, tmp_path):
+        saver = H5Saver()
+        data = {"a": [1.0, 2.0], "b": [[1, 2], [3, 4]], "c": [[1, 2], [3]]}
+        filepath = str(tmp_path / "test.h5")
+        saver.save_to_h5(data, filepath)
+
+        loaded = saver.load_from_h5(filepath)
+        assert np.array_equal(loaded["a"], [1.0, 2.0])
+        assert np.array_equal(loaded["b"], [[1, 2], [3, 4]])
+        # ragged lists are saved element-wise as strings
+        assert loaded["c"] == {"0": "[1, 2]", "1": "[3]"}
+
+    def test_string_list(self, tmp_path):
+        saver = H5Saver()
+        data = {"a": ["x", "yy", "zzz"], "b": {"c": ["d"]}}
+        filepath = str(tmp_path / "test.h5")
+        saver.save_to_h5(data, filepath)
+
+        loaded = saver.load_from_h5(filepath)
+        assert loaded["a"] == ["x", "yy", "zzz"]
+        assert loaded["b"]["c"] == ["d"]
+
+    def test_fixed_length_bytes_array(self, tmp_path):
+        saver = H5Saver()
+        data = {"a": np.array([b"a", b"b"])}
+        filepath = str(tmp_path / "test.h5")
+        saver.save_to_h5(data, filepath)
+
+        loaded = saver.load_from_h5(filepath)
+        assert isinstance(loaded["a"], np.ndarray)
+        assert np.array_equal(loaded["a"], np.array([b"a", b"b"]))
+
+    def test_large_array(self, tmp_path):
+        saver = H5Saver()
+        image = np.random.rand(300, 400)
+        data = {"image": image, "small": np.arange(10)}
+        filepath = str(tmp_path / "test.h5")
+        saver.save_to_h5(data, filepath)
+
+        with h5py.File(filepath, "r") as f:
+            assert f["image"].compression == "lzf"
+            assert f["image"].chunks == (256, 256)
+            assert f["image"].shuffle
+            assert f["small"].compression is None
+
+        loaded = saver.load_from_h5(filepath)
+        assert np.array_equal(loaded["image"], image)
+        assert np.array_equal(loaded["small"], np.arange(10))
+
+    def test_attrs(self, tmp_path):
+        saver = H5Saver()
+        data = {"attrs": {"a": 1.0}, "b": {"attrs": None, "c": 2.0}}
+        filepath = str(tmp_path / "test.h5")
+        saver.save_to_h5(data, filepath)
+
+        loaded = saver.load_from_h5(filepath)
+        assert loaded["attrs"] == {"a": 1.0}
+        assert "attrs" not in loaded["b"]
+
+    def test_nested(self, tmp_path):
+        saver = H5Saver()
+        data = {"a": {"b": {"c": {"d": 1.0}}, "e": [{"f": 2.0}, {"g": "h"}]}}
+        filepath = str(tmp_path / "test.h5")
+        saver.save_to_h5(data, filepath)
+
+        loaded = saver.load_from_h5(filepath)
+        assert loaded["a"]["b"]["c"]["d"] == 1.0
+        assert loaded["a"]["e"]["0"]["f"] == 2.0
+        assert loaded["a"]["e"]["1"]["g"] == "h"
+        assert list(loaded["a"].keys()) == ["b", "e"]
+
+    def test_invalid_arguments(self, tmp_path):
+        saver = H5Saver()
+        with pytest.raises(TypeError):
+            saver.save_to_h5([1.0], str(tmp_path / "test.h5"))
+        with pytest.raises(TypeError):
+            saver.save_to_h5({"a": 1.0}, Path(tmp_path / "test.h5"))